@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kubernetes Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+################################################################################
+# usage: image-loadtest.py [FLAGS]
+#  This program runs concurrent synthetic builds through the stages of
+#  image-new-kube.py, image-build-ova.py and image-upload.py using local
+#  stand-ins for the Kubernetes release buckets, GCS, vmware-vdiskmanager and
+#  gsutil, and reports the throughput, latency and resource usage per stage.
+#  This program requires Python 3.7+.
+################################################################################
+
+import argparse
+import functools
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import stat
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+HACK_DIR = os.path.dirname(os.path.abspath(__file__))
+KUBE_SCRIPT = os.path.join(HACK_DIR, 'image-new-kube.py')
+
+KUBE_SEMVER = "v1.16.3"
+KUBE_CI_SEMVER = "v1.17.0-beta.2.12+4d8e7a2c0d6f1b"
+
+# The version strings resolved by the synthetic builds. They are used in a
+# round-robin fashion so that both the offline and the network code paths of
+# the resolver are exercised.
+KUBE_VERSIONS = ["1.16.3-0", KUBE_SEMVER, "ci/latest", "release/stable"]
+
+STAGES = [
+    "resolve",
+    "stream-optimize",
+    "ovf",
+    "manifest",
+    "ova",
+    "remote-checksum",
+    "upload",
+]
+
+_FAKE_VDISKMANAGER = '''#!%(python)s
+# A stand-in for vmware-vdiskmanager that copies the source disk to the
+# destination instead of stream-optimizing it.
+import os
+import shutil
+import sys
+import time
+
+args = sys.argv[1:]
+infile = args[args.index('-r') + 1]
+outfile = args[-1]
+time.sleep(float(os.getenv('FAKE_VDISKMANAGER_DELAY', '0')))
+shutil.copyfile(infile, outfile)
+'''
+
+_FAKE_GSUTIL = '''#!%(python)s
+# A stand-in for gsutil that copies a local file into the directory served by
+# the local object store.
+import os
+import shutil
+import sys
+
+args = sys.argv[1:]
+if args[0] != 'cp':
+    sys.exit("fake gsutil: unsupported command %%s" %% args[0])
+dst = args[2]
+if not dst.startswith('gs://'):
+    sys.exit("fake gsutil: unsupported destination %%s" %% dst)
+dst = os.path.join(os.environ['FAKE_GCS_ROOT'], dst[len('gs://'):])
+if not os.path.isdir(os.path.dirname(dst)):
+    os.makedirs(os.path.dirname(dst))
+shutil.copyfile(args[1], dst)
+'''
+
+# The ways in which the resolve stage may run image-new-kube.py:
+#   inprocess  KubeVersionResolver.Resolve is called in the worker process
+#   cli        image-new-kube.py VERSION is run once per build
+#   stdin      one image-new-kube.py --stdin process is run per worker
+RESOLVE_MODES = ['inprocess', 'cli', 'stdin']
+
+# The hack scripts are loaded by each worker process.
+_kube = None
+_ova = None
+_upload = None
+
+# The image-new-kube.py --stdin process started by a worker in stdin mode.
+_resolver_proc = None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs concurrent synthetic builds using local stand-ins")
+    parser.add_argument('--builds',
+                        type=int,
+                        default=16,
+                        metavar='N',
+                        help='The total number of synthetic builds')
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=4,
+                        metavar='N',
+                        help='The number of builds run at the same time')
+    parser.add_argument('--disk-size-mb',
+                        dest='disk_size_mb',
+                        type=int,
+                        default=64,
+                        metavar='MB',
+                        help='The size of each synthetic VMDK')
+    parser.add_argument('--vdiskmanager-delay',
+                        dest='vdiskmanager_delay',
+                        type=float,
+                        default=0,
+                        metavar='SECONDS',
+                        help='Time the fake vmware-vdiskmanager sleeps')
+    parser.add_argument('--cached-ratio',
+                        dest='cached_ratio',
+                        type=float,
+                        default=0,
+                        metavar='RATIO',
+                        help='Fraction of builds whose checksum is already '
+                             'in the object store, so the upload is skipped')
+    parser.add_argument('--resolve-mode',
+                        dest='resolve_mode',
+                        choices=RESOLVE_MODES,
+                        default='inprocess',
+                        help='How the resolve stage runs image-new-kube.py. '
+                             'In stdin mode the CPU time of the resolver '
+                             'process is not included in the report')
+    parser.add_argument('--latency-ms',
+                        dest='latency_ms',
+                        type=float,
+                        default=0,
+                        metavar='MS',
+                        help='Latency added to each local HTTP response')
+    parser.add_argument('--work-dir',
+                        dest='work_dir',
+                        metavar='DIR',
+                        help='Where the builds are written (default: temp)')
+    parser.add_argument('--json',
+                        dest='json',
+                        action='store_true',
+                        help='Print the report as JSON')
+    args = parser.parse_args()
+
+    if args.builds < 1 or args.concurrency < 1:
+        parser.error("--builds and --concurrency must be at least 1")
+    if args.cached_ratio < 0 or args.cached_ratio > 1:
+        parser.error("--cached-ratio must be between 0 and 1")
+
+    work_dir = args.work_dir
+    cleanup = work_dir is None
+    if cleanup:
+        work_dir = tempfile.mkdtemp(prefix='image-loadtest-')
+    work_dir = os.path.abspath(work_dir)
+
+    try:
+        report = run(args, work_dir)
+    finally:
+        if cleanup:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print_report(report)
+
+
+def run(args, work_dir):
+    www_dir = os.path.join(work_dir, 'www')
+    bin_dir = os.path.join(work_dir, 'bin')
+    builds_dir = os.path.join(work_dir, 'builds')
+    for d in [www_dir, bin_dir, builds_dir]:
+        if not os.path.isdir(d):
+            os.makedirs(d)
+
+    create_fake_buckets(www_dir)
+    create_fake_tools(bin_dir)
+
+    server = start_object_store(www_dir, args.latency_ms / 1000.0)
+    base_url = "http://%s:%d" % server.server_address[:2]
+
+    os.environ['PATH'] = "%s%s%s" % (bin_dir, os.pathsep, os.environ['PATH'])
+    os.environ['FAKE_GCS_ROOT'] = www_dir
+    os.environ['FAKE_VDISKMANAGER_DELAY'] = str(args.vdiskmanager_delay)
+    os.environ['KUBE_RELEASE_SRC'] = "%s/kubernetes-release" % base_url
+    os.environ['KUBE_CI_SRC'] = "%s/kubernetes-release-dev" % base_url
+
+    build = functools.partial(run_build,
+                              base_url=base_url,
+                              www_dir=www_dir,
+                              builds_dir=builds_dir,
+                              disk_size=args.disk_size_mb * 1024 * 1024,
+                              cached_ratio=args.cached_ratio,
+                              resolve_mode=args.resolve_mode)
+    try:
+        pool = multiprocessing.Pool(args.concurrency, init_worker)
+        start = time.time()
+        try:
+            results = pool.map(build, range(args.builds), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        elapsed = time.time() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return summarize(results, elapsed, args)
+
+
+def create_fake_buckets(root):
+    rel = os.path.join(root, 'kubernetes-release')
+    dev = os.path.join(root, 'kubernetes-release-dev')
+    write_kube_tarball(os.path.join(rel, 'release', KUBE_SEMVER), KUBE_SEMVER)
+    write_file(os.path.join(rel, 'release', 'stable.txt'), KUBE_SEMVER)
+    write_kube_tarball(os.path.join(dev, 'ci', KUBE_CI_SEMVER), KUBE_CI_SEMVER)
+    write_file(os.path.join(dev, 'ci', 'latest.txt'), KUBE_CI_SEMVER)
+
+
+def write_kube_tarball(dir_path, version):
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+    data = version.encode('utf-8')
+    info = tarfile.TarInfo('kubernetes/version')
+    info.size = len(data)
+    path = os.path.join(dir_path, 'kubernetes.tar.gz')
+    with tarfile.open(path, mode='w:gz') as tar:
+        tar.addfile(info, io.BytesIO(data))
+
+
+def write_file(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def create_fake_tools(bin_dir):
+    for name, template in [('vmware-vdiskmanager', _FAKE_VDISKMANAGER),
+                           ('gsutil', _FAKE_GSUTIL)]:
+        path = os.path.join(bin_dir, name)
+        write_file(path, template % {'python': sys.executable})
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP)
+
+
+def start_object_store(root, latency):
+    class Handler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=root, **kwargs)
+
+        def send_head(self):
+            if latency:
+                time.sleep(latency)
+            return super().send_head()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+def load_hack_script(name):
+    path = os.path.join(HACK_DIR, "%s.py" % name)
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def init_worker():
+    global _kube, _ova, _upload
+    _kube = load_hack_script('image-new-kube')
+    _ova = load_hack_script('image-build-ova')
+    _upload = load_hack_script('image-upload')
+
+    # The hack scripts report their progress on stdout.
+    sys.stdout = open(os.devnull, 'w')
+
+
+def run_build(index, base_url, www_dir, builds_dir, disk_size, cached_ratio,
+              resolve_mode):
+    name = "loadtest-%d" % index
+    build_dir = os.path.join(builds_dir, name)
+    os.makedirs(build_dir)
+    os.chdir(build_dir)
+
+    vmdk = "%s-disk1.vmdk" % name
+    write_zeros(vmdk, disk_size)
+
+    stages = {}
+
+    def timed(stage, fn, *args):
+        t0 = time.time()
+        r0 = resource.getrusage(resource.RUSAGE_SELF)
+        c0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        result = fn(*args)
+        r1 = resource.getrusage(resource.RUSAGE_SELF)
+        c1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        stages[stage] = {
+            'seconds': time.time() - t0,
+            'user': (r1.ru_utime - r0.ru_utime) + (c1.ru_utime - c0.ru_utime),
+            'sys': (r1.ru_stime - r0.ru_stime) + (c1.ru_stime - c0.ru_stime),
+        }
+        return result
+
+    version = KUBE_VERSIONS[index % len(KUBE_VERSIONS)]
+    kube = timed('resolve', resolve, version, resolve_mode)
+    semver = kube[_kube.KUBE_RESOLVED_SEM]
+
+    vmdk_files = [{'name': vmdk, 'size': disk_size}]
+    timed('stream-optimize', _ova.stream_optimize_vmdk_files, vmdk_files)
+    vmdk = vmdk_files[0]
+
+    ovf = "%s.ovf" % name
+    timed('ovf', _ova.create_ovf, ovf,
+          ovf_data(name, semver, kube[_kube.KUBE_RESOLVED_SRC], vmdk))
+
+    ova_manifest = "%s.mf" % name
+    timed('manifest', _ova.create_ova_manifest, ova_manifest,
+          [ovf, vmdk['stream_name']])
+
+    ova = "%s.ova" % name
+    ova_sum = "%s.sha256" % ova
+    timed('ova', _ova.create_ova, ova,
+          [ovf, ova_manifest, vmdk['stream_name']])
+
+    rem_path = "capv-images/ci/%s/%s-kube-%s.ova" % (semver, name, semver)
+    rem_sum_path = "%s.sha256" % rem_path
+
+    # Seed the object store with a matching checksum for a fraction of the
+    # builds, as if they had been uploaded by an earlier run.
+    cached = int((index + 1) * cached_ratio) > int(index * cached_ratio)
+    if cached:
+        dst = os.path.join(www_dir, rem_sum_path)
+        if not os.path.isdir(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst))
+        shutil.copyfile(ova_sum, dst)
+
+    lcl_sum = _upload.get_local_checksum(ova_sum)
+    rem_sum = timed('remote-checksum', _upload.get_remote_checksum,
+                    "%s/%s" % (base_url, rem_sum_path))
+
+    if lcl_sum != rem_sum:
+        timed('upload', _upload.upload_ova, ova, ova_sum,
+              "gs://%s" % rem_path, "gs://%s" % rem_sum_path)
+
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+    # ru_maxrss is the peak over the life of the worker and of its waited-for
+    # children, so it is reported per worker rather than per stage. On Linux
+    # the peak of a child is at least the RSS of the worker when it forked.
+    return {
+        'worker': os.getpid(),
+        'cached': cached,
+        'stages': stages,
+        'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'children_maxrss_kb':
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def resolve(version, mode):
+    global _resolver_proc
+    if mode == 'inprocess':
+        return _kube.KubeVersionResolver().Resolve(version)
+
+    if mode == 'cli':
+        out = subprocess.check_output(
+            [sys.executable, KUBE_SCRIPT, version], universal_newlines=True)
+        return json.loads(out)
+
+    # The first query of each worker also pays for starting the process.
+    if _resolver_proc is None:
+        _resolver_proc = subprocess.Popen(
+            [sys.executable, KUBE_SCRIPT, '--stdin'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True)
+    _resolver_proc.stdin.write("%s\n" % version)
+    _resolver_proc.stdin.flush()
+    result = json.loads(_resolver_proc.stdout.readline())
+    if 'error' in result:
+        raise Exception(result['error'])
+    return result
+
+
+def write_zeros(path, size):
+    block = b'\0' * 1048576
+    with open(path, 'wb') as f:
+        while size > 0:
+            f.write(block[:size])
+            size -= len(block)
+
+
+def ovf_data(name, semver, source_type, vmdk):
+    return {
+        'BUILD_DATE': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'BUILD_NAME': name,
+        'ARTIFACT_ID': name,
+        'BUILD_TIMESTAMP': str(int(time.time())),
+        'CNI_VERSION': 'v0.7.5',
+        'CONTAINERD_VERSION': '1.3.0',
+        'EULA': '',
+        'OS_NAME': 'ubuntu',
+        'OS_ID': '94',
+        'OS_TYPE': 'ubuntu-64',
+        'OS_VERSION': '',
+        'IB_VERSION': 'loadtest',
+        'ISO_CHECKSUM': '',
+        'ISO_CHECKSUM_TYPE': 'sha256',
+        'ISO_URL': '',
+        'KUBERNETES_SEMVER': semver,
+        'KUBERNETES_SOURCE_TYPE': source_type,
+        'POPULATED_DISK_SIZE': vmdk['size'],
+        'STREAM_DISK_SIZE': vmdk['stream_size'],
+        'VMX_VERSION': '13',
+    }
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    i = int(round(p / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[i]
+
+
+def summarize(results, elapsed, args):
+    report = {
+        'builds': args.builds,
+        'concurrency': args.concurrency,
+        'disk_size_mb': args.disk_size_mb,
+        'cached_ratio': args.cached_ratio,
+        'resolve_mode': args.resolve_mode,
+        'cached_builds': len([r for r in results if r['cached']]),
+        'elapsed_seconds': elapsed,
+        'builds_per_minute': args.builds * 60.0 / elapsed,
+        'stages': {},
+    }
+    for stage in STAGES:
+        samples = [r['stages'][stage] for r in results
+                   if stage in r['stages']]
+        if not samples:
+            continue
+        seconds = sorted(s['seconds'] for s in samples)
+        report['stages'][stage] = {
+            'count': len(samples),
+            'mean': sum(seconds) / len(seconds),
+            'p50': percentile(seconds, 50),
+            'p95': percentile(seconds, 95),
+            'p99': percentile(seconds, 99),
+            'max': seconds[-1],
+            'cpu_user': sum(s['user'] for s in samples) / len(samples),
+            'cpu_sys': sum(s['sys'] for s in samples) / len(samples),
+        }
+
+    # Keep the last, and so the largest, peak RSS reported by each worker.
+    workers = {}
+    for r in results:
+        workers[r['worker']] = {
+            'maxrss_kb': r['maxrss_kb'],
+            'children_maxrss_kb': r['children_maxrss_kb'],
+        }
+    report['workers'] = {
+        'count': len(workers),
+        'maxrss_kb': max(w['maxrss_kb'] for w in workers.values()),
+        'children_maxrss_kb':
+            max(w['children_maxrss_kb'] for w in workers.values()),
+    }
+    return report
+
+
+def print_report(report):
+    print("image-loadtest: %d builds, concurrency %d, %d MB disks" % (
+        report['builds'], report['concurrency'], report['disk_size_mb']))
+    print("image-loadtest: resolve mode %s, %d of %d builds cached" % (
+        report['resolve_mode'], report['cached_builds'], report['builds']))
+    print("image-loadtest: %.2fs elapsed, %.2f builds/min" % (
+        report['elapsed_seconds'], report['builds_per_minute']))
+    print("")
+    fmt = "%-16s %5s %8s %8s %8s %8s %8s %8s %8s"
+    print(fmt % ('STAGE', 'COUNT', 'MEAN', 'P50', 'P95', 'P99', 'MAX',
+                 'CPU-USR', 'CPU-SYS'))
+    row = "%-16s %5d %8.3f %8.3f %8.3f %8.3f %8.3f %8.3f %8.3f"
+    for stage in STAGES:
+        s = report['stages'].get(stage)
+        if s is None:
+            continue
+        print(row % (stage, s['count'], s['mean'], s['p50'], s['p95'],
+                     s['p99'], s['max'], s['cpu_user'], s['cpu_sys']))
+    print("")
+    w = report['workers']
+    print("image-loadtest: peak RSS over %d workers: %d KB worker, "
+          "%d KB largest child" % (w['count'], w['maxrss_kb'],
+                                   w['children_maxrss_kb']))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,19 +14,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import re
-import requests
 import sys
-import tarfile
-from io import BytesIO
 
-KUBE_CI_SRC = "https://storage.googleapis.com/kubernetes-release-dev"
-KUBE_RELEASE_SRC = "https://storage.googleapis.com/kubernetes-release"
+KUBE_CI_SRC = os.getenv(
+    'KUBE_CI_SRC', "https://storage.googleapis.com/kubernetes-release-dev")
+KUBE_RELEASE_SRC = os.getenv(
+    'KUBE_RELEASE_SRC', "https://storage.googleapis.com/kubernetes-release")
 
 KUBE_RESOLVED_SEM = "kubernetes_semver"
 KUBE_RESOLVED_SRC = "kubernetes_http_source"
 KUBE_RESOLVED_VER = "kubernetes_version"
 
+# The patterns used to classify version strings are compiled once at import
+# time so they are not recompiled for every version that is resolved.
+_PKG_VERSION_RX = re.compile(r'^(\d+\.\d+.\d+)\-\d+$')
+_HTTP_URL_RX = re.compile(r'(?i)^https?:')
+_SEMVER_RX = re.compile(r'^v?\d+(?:\.\d+){0,3}(?:[.+-].+)?$')
+_RELEASE_BUILD_RX = re.compile(r'^release/.+$')
+
 # KubeVersionResolver is used for resolving Kubernetes version strings to the
 # actual version and URL or package string that may be used to deploy
 # Kubernetes.
@@ -37,52 +44,68 @@ class KubeVersionResolver(object):
     # Resolve accepts a Kubernetes version string and returns a dictionary with
     # information that can be used to deploy the provided version.
     def Resolve(self, version):
-        if version == "":
-            raise Exception("version is required")
-
-        result = {
-            KUBE_RESOLVED_SEM: version,
-            KUBE_RESOLVED_SRC: 'pkg',
-            KUBE_RESOLVED_VER: version,
-        }
-
-        # When version is "latest" then the returned dictionary points
-        # to the latest package for Kubernetes.
-        if version == "latest":
+        result = self.ResolveOffline(version)
+        if result is not None:
             return result
-        # Otherwise check to see if the provided version matches a
-        # managed package format. Technically the else clause could be
-        # descoped one level, but by placing the logic in the scope of
-        # the else clause, the scope of "match" is isolated from the
-        # rest of this function.
-        else:
-            match = re.match(r'^(\d+\.\d+.\d+)\-\d+$', version)
-            if match:
-                result[KUBE_RESOLVED_SEM] = 'v%s' % match.groups(1)[0]
-                return result
 
+        # Otherwise the version is resolved to the URL of a Kubernetes build,
+        # and the actual Kubernetes version is read from the build's tarball.
         url = ""
-        if re.match(r'(?i)^https?:', version):
+        if _HTTP_URL_RX.match(version):
             url = version
-        elif re.match(r'^v?\d+(?:\.\d+){0,3}(?:[.+-].+)?$', version):
+        elif _SEMVER_RX.match(version):
             if not version.startswith('v'):
                 version = "v%s" % version
             url = "%s/release/%s" % (KUBE_RELEASE_SRC, version)
         elif version.startswith('ci/'):
             url = self.__resolve_build_url(version, True)
-        elif re.match(r'^release/.+$', version):
+        elif _RELEASE_BUILD_RX.match(version):
             url = self.__resolve_build_url(version, False)
         else:
             raise Exception("Invalid Kubernetes version: %s" % version)
-        result[KUBE_RESOLVED_SRC] = url
 
         version = self.__read_version_from_kube_tarball(url)
-        result[KUBE_RESOLVED_SEM] = version
-        result[KUBE_RESOLVED_VER] = version
+        return {
+            KUBE_RESOLVED_SEM: version,
+            KUBE_RESOLVED_SRC: url,
+            KUBE_RESOLVED_VER: version,
+        }
 
-        return result
+    # ResolveOffline accepts a Kubernetes version string and returns the same
+    # dictionary as Resolve if the version can be resolved without accessing
+    # the network, such as "latest" or a package version like "1.14.0-0".
+    # Otherwise None is returned.
+    def ResolveOffline(self, version):
+        if version == "":
+            raise Exception("version is required")
+
+        result = {
+            KUBE_RESOLVED_SEM: version,
+            KUBE_RESOLVED_SRC: 'pkg',
+            KUBE_RESOLVED_VER: version,
+        }
+
+        # When version is "latest" then the returned dictionary points
+        # to the latest package for Kubernetes.
+        if version == "latest":
+            return result
+
+        # Otherwise check to see if the provided version matches a
+        # managed package format, ex. 1.14.0-0, in which case the
+        # semantic version is the package version without the package
+        # revision.
+        match = _PKG_VERSION_RX.match(version)
+        if match:
+            result[KUBE_RESOLVED_SEM] = 'v%s' % match.group(1)
+            return result
+
+        return None
 
     def __resolve_build_url(self, buildID, ciBuild):
+        # requests is imported lazily so that versions which are resolved
+        # offline do not pay the cost of loading the network stack.
+        import requests
+
         url = ""
         if ciBuild:
             url = "%s/%s" % (KUBE_CI_SRC, buildID)
@@ -115,6 +138,10 @@ class KubeVersionResolver(object):
         return url
 
     def __read_version_from_kube_tarball(self, url):
+        import requests
+        import tarfile
+        from io import BytesIO
+
         url = "%s/kubernetes.tar.gz" % url
         r = requests.get(url)
         if not r.status_code == 200:
@@ -122,7 +149,7 @@ class KubeVersionResolver(object):
         b = BytesIO(r.content)
         t = tarfile.open(fileobj=b, mode='r')
         v = t.extractfile("kubernetes/version")
-        return v.read().strip()
+        return v.read().decode('utf-8').strip()
 
 
 if __name__ == "__main__":
@@ -145,6 +172,9 @@ if __name__ == "__main__":
             REL_SRC   storage.googleapis.com/kubernetes-release
             K8S_TGZ   kubernetes.tar.gz
 
+            The DEV_SRC and REL_SRC URLs may be overridden with the environment
+            variables KUBE_CI_SRC and KUBE_RELEASE_SRC.
+
             PACKAGE MANAGER INSTALLATION
             ====================================================================
             If the version string matches the pattern "^\d+\.\d+.\d+\-\d+$",
@@ -186,15 +216,42 @@ if __name__ == "__main__":
 
             The resolved URL is used to install Kuberentes from the set of
             pre-built container images and binaries.
+
+            STDIN MODE
+            ====================================================================
+            When --stdin is specified the version strings are read from
+            standard input, one per line, and the result for each line is
+            written to standard output as a single line of JSON. This allows
+            a single process to resolve many version strings. If a version
+            cannot be resolved then the JSON object contains a single key,
+            "error", and the remaining lines are still processed.
     '''))
     parser.add_argument('version',
-                        nargs=1,
+                        nargs='?',
                         help='A Kubernetes version string')
+    parser.add_argument('--stdin',
+                        dest='stdin',
+                        action='store_true',
+                        help='Read version strings from stdin, one per line')
 
     args = parser.parse_args()
-    resolver = KubeVersionResolver()
-    result = resolver.Resolve(args.version[0])
+    if args.stdin == (args.version is not None):
+        parser.error("either a version or --stdin is required")
 
     import json
-    data = json.dumps(result, indent=2)
-    print(data)
+    resolver = KubeVersionResolver()
+
+    if not args.stdin:
+        result = resolver.Resolve(args.version)
+        data = json.dumps(result, indent=2)
+        print(data)
+        sys.exit(0)
+
+    for line in iter(sys.stdin.readline, ''):
+        version = line.strip()
+        try:
+            data = json.dumps(resolver.Resolve(version), sort_keys=True)
+        except Exception as e:
+            data = json.dumps({'error': str(e)}, sort_keys=True)
+        print(data)
+        sys.stdout.flush()
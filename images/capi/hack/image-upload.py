@@ -102,10 +102,7 @@ def main():
     atexit.register(deactivate_service_account)
 
     # Upload the OVA and its checksum.
-    print("image-upload-ova: upload %s" % gcs_ova)
-    subprocess.check_call(['gsutil', 'cp', ova, gcs_ova])
-    print("image-upload-ova: upload %s" % gcs_ova_sum)
-    subprocess.check_call(['gsutil', 'cp', ova_sum, gcs_ova_sum])
+    upload_ova(ova, ova_sum, gcs_ova, gcs_ova_sum)
 
     print("image-upload-ova: download from %s" % url_ova)
 
@@ -123,6 +120,13 @@ def deactivate_service_account():
     subprocess.call(["gcloud", "auth", "revoke"])
 
 
+def upload_ova(ova, ova_sum, gcs_ova, gcs_ova_sum):
+    print("image-upload-ova: upload %s" % gcs_ova)
+    subprocess.check_call(['gsutil', 'cp', ova, gcs_ova])
+    print("image-upload-ova: upload %s" % gcs_ova_sum)
+    subprocess.check_call(['gsutil', 'cp', ova_sum, gcs_ova_sum])
+
+
 def get_remote_checksum(url):
     r = requests.get(url)
     if r.status_code >= 200 and r.status_code <= 299: